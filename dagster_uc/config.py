@@ -1,10 +1,19 @@
+import glob
+import hashlib
+import json
 import os
+from collections import OrderedDict
+from copy import copy, deepcopy
 from dataclasses import dataclass, fields
 
 import yaml
 
 from dagster_uc.log import logger
 
+# Use the libyaml C bindings when pyyaml was built with them, the pure python ones are much slower
+YamlLoader = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+YamlDumper = getattr(yaml, "CSafeDumper", yaml.SafeDumper)
+
 
 @dataclass
 class UserCodeDeploymentsConfig:
@@ -40,6 +49,86 @@ class UserCodeDeploymentsConfig:
     dagster_workspace_yaml_configmap_name: str = "dagster-workspace-yaml"
     uc_deployment_semaphore_name: str = "dagster-uc-semaphore"
 
+    def to_dict(self) -> dict:
+        """Returns the config as a dict. Unlike dataclasses.asdict this does not recurse into the fields,
+        list and dict fields are shallow copies.
+        """
+        return {name: copy(getattr(self, name)) for name in _CONFIG_FIELD_NAMES}
+
+
+_CONFIG_FIELD_NAMES = tuple(field.name for field in fields(UserCodeDeploymentsConfig))
+
+# Parsed config files keyed on absolute path, storing (file version, parsed yaml). The file version is
+# (st_mtime_ns, st_ctime_ns, st_size, st_ino), the ctime also changes when a tool restores the mtime.
+_CONFIG_CACHE: "OrderedDict[str, tuple[tuple[int, ...], dict]]" = OrderedDict()
+_CONFIG_CACHE_MAX_SIZE = 100
+
+
+def get_cache_dir() -> str:
+    """Returns the directory in which dagster-uc stores its on-disk caches."""
+    cache_home = os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache")
+    return os.path.join(cache_home, "dagster-uc")
+
+
+def _sidecar_prefix(path: str) -> str:
+    """Returns the path prefix of the json sidecars of a config file, unique per config file."""
+    path_hash = hashlib.sha1(path.encode("utf-8")).hexdigest()[:16]
+    return os.path.join(get_cache_dir(), f"{os.path.basename(path)}.{path_hash}")
+
+
+def _load_sidecar(sidecar_path: str) -> dict | None:
+    """Loads the json sidecar of a config file, returns None if it is missing or unreadable."""
+    try:
+        with open(sidecar_path) as stream:
+            return json.load(stream)
+    except (OSError, ValueError):
+        return None
+
+
+def _write_sidecar(path: str, sidecar_path: str, raw_yaml: dict) -> None:
+    """Writes the parsed config to a json sidecar and removes sidecars of older versions of the file."""
+    try:
+        data = json.dumps(raw_yaml)
+        os.makedirs(get_cache_dir(), mode=0o700, exist_ok=True)
+        tmp_path = f"{sidecar_path}.{os.getpid()}.tmp"
+        # The config can contain credentials, so the copy is only readable by the current user
+        fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, "w") as stream:
+            stream.write(data)
+        os.replace(tmp_path, sidecar_path)
+        for stale_path in glob.glob(f"{glob.escape(_sidecar_prefix(path))}.*.json"):
+            if stale_path != sidecar_path:
+                os.remove(stale_path)
+    except (OSError, TypeError, ValueError) as e:
+        logger.debug(f"Could not write config cache to '{sidecar_path}': {e}")
+
+
+def _read_config_file(path: str) -> dict:
+    """Parses the yaml config file, serving it from an in-memory cache or a json sidecar in the
+    cache dir if the file is unchanged.
+    """
+    path = os.path.abspath(path)
+    stat = os.stat(path)
+    version = (stat.st_mtime_ns, stat.st_ctime_ns, stat.st_size, stat.st_ino)
+    cached = _CONFIG_CACHE.get(path)
+    if cached is not None and cached[0] == version:
+        _CONFIG_CACHE.move_to_end(path)
+        return deepcopy(cached[1])
+
+    # The file version is part of the sidecar name, so a changed config file never hits a stale sidecar
+    sidecar_path = f"{_sidecar_prefix(path)}.{'-'.join(map(str, version))}.json"
+    raw_yaml = _load_sidecar(sidecar_path)
+    if raw_yaml is None:
+        with open(path) as stream:
+            raw_yaml = yaml.load(stream, Loader=YamlLoader)
+        _write_sidecar(path, sidecar_path, raw_yaml)
+
+    _CONFIG_CACHE[path] = (version, raw_yaml)
+    _CONFIG_CACHE.move_to_end(path)
+    while len(_CONFIG_CACHE) > _CONFIG_CACHE_MAX_SIZE:
+        _CONFIG_CACHE.popitem(last=False)
+    return deepcopy(raw_yaml)
+
 
 def load_config(environment: str, path: str | None) -> "UserCodeDeploymentsConfig":
     """Loads the configuration file from the local dir or the user's home dir."""
@@ -57,17 +146,16 @@ def load_config(environment: str, path: str | None) -> "UserCodeDeploymentsConfi
                 f"Could not load config file. Tried the following locations: {paths_to_try}\nCurrent folder: {os.getcwd()}\nContents of current folder: {os.listdir(os.getcwd())}\n\n Tip: Place the config file in the same folder you're calling this script from, or your home directory, or specify the path manually using --config-file <path>",
             )
 
-    with open(path) as stream:
-        raw_yaml = yaml.safe_load(stream)
-        if environment not in raw_yaml:
-            raise Exception(
-                f"Environment '{environment}' not specified in configuration file at '{path}'",
-            )
-        data = raw_yaml[environment]
+    raw_yaml = _read_config_file(path)
+    if environment not in raw_yaml:
+        raise Exception(
+            f"Environment '{environment}' not specified in configuration file at '{path}'",
+        )
+    data = raw_yaml[environment]
 
-    for field in fields(UserCodeDeploymentsConfig):
-        if os.environ.get(field.name.upper(), None) is not None:
-            data[field.name] = os.environ[field.name.upper()]
+    for name in _CONFIG_FIELD_NAMES:
+        if os.environ.get(name.upper(), None) is not None:
+            data[name] = os.environ[name.upper()]
 
     logger.debug(f"Using configuration:\n {data}")
     return UserCodeDeploymentsConfig(**data)
@@ -5,22 +5,30 @@ import json
 import logging
 import os
 import pprint
-import subprocess
+import sys
+import threading
 import time
-from dataclasses import asdict
-from typing import Annotated, cast
+from functools import partial
+from typing import TYPE_CHECKING, Annotated
 
-import kr8s
 import typer
-from kr8s.objects import (
-    ConfigMap,
-    Pod,
-)
+import yaml
 
-from dagster_uc.config import UserCodeDeploymentsConfig, load_config
+from dagster_uc.config import UserCodeDeploymentsConfig, YamlDumper, load_config
 from dagster_uc.log import logger
-from dagster_uc.uc_handler import DagsterUserCodeHandler
-from dagster_uc.utils import BuildTool, build_and_push, gen_tag
+from dagster_uc.utils import (
+    BuildTool,
+    build_and_push,
+    gen_tag,
+    is_command_available,
+    login_registry,
+    run_concurrently,
+)
+
+if TYPE_CHECKING:
+    from kr8s.objects import Pod
+
+    from dagster_uc.uc_handler import DagsterUserCodeHandler
 
 app = typer.Typer(invoke_without_command=True)
 deployment_app = typer.Typer(
@@ -40,9 +48,14 @@ deployment_check_app = typer.Typer(
 )
 deployment_app.add_typer(deployment_check_app)
 
-handler: DagsterUserCodeHandler
+handler: "DagsterUserCodeHandler"
 config: UserCodeDeploymentsConfig
 
+_REQUESTS_DEFAULT = {"cpu": "1", "memory": "1Gi"}
+_REQUESTS_DEFAULT_STR = json.dumps(_REQUESTS_DEFAULT)
+_LIMITS_DEFAULT = {"cpu": "2", "memory": "2Gi"}
+_LIMITS_DEFAULT_STR = json.dumps(_LIMITS_DEFAULT)
+
 
 @app.command("show-config", help="Outputs the configuration that is currently in use")
 def show_config():
@@ -69,25 +82,34 @@ def default(
 
     logger.setLevel(logging.DEBUG if verbose else logging.INFO)
     config = load_config(environment, config_file_path)
+    if verbose:
+        config.verbose = True
 
-    if ctx.invoked_subcommand == "init-config":
-        pass
-    else:
-        if verbose:
-            config.verbose = True
-        logger.debug(f"Switching kubernetes context to {config.environment}...")
-        kr8s_api = kr8s.api(context=f"{config.kubernetes_context}", namespace=config.namespace)
+    if ctx.invoked_subcommand in ("init-config", "show-config"):
+        # These commands don't talk to the cluster, so we skip importing the kubernetes client
+        return
+
+    import kr8s
+
+    from dagster_uc.uc_handler import DagsterUserCodeHandler
 
-        handler = DagsterUserCodeHandler(config, kr8s_api)
-        handler._ensure_dagster_version_match()
-        handler.maybe_create_user_deployments_configmap()
-        logger.debug(f"Done: Switched kubernetes context to {config.environment}")
+    logger.debug(f"Switching kubernetes context to {config.environment}...")
+    kr8s_api = kr8s.api(context=f"{config.kubernetes_context}", namespace=config.namespace)
+
+    handler = DagsterUserCodeHandler(config, kr8s_api)
+    handler._ensure_dagster_version_match()
+    handler.maybe_create_user_deployments_configmap()
+    logger.debug(f"Done: Switched kubernetes context to {config.environment}")
+
+
+def get_image_name(deployment_name: str, image_prefix: str | None) -> str:
+    """Returns the name of the container image of a user-code deployment, without registry and tag"""
+    return os.path.join(image_prefix, deployment_name) if image_prefix else deployment_name
 
 
 def build_push_container(
-    deployment_name: str,
+    image_name: str,
     branch_name: str,
-    image_prefix: str | None,
     config: UserCodeDeploymentsConfig,
     use_sudo: bool,
     tag: str,
@@ -97,9 +119,7 @@ def build_push_container(
     build_and_push(
         config.repository_root,
         config.container_registry,
-        image_name=deployment_name
-        if not image_prefix
-        else os.path.join(image_prefix, deployment_name),
+        image_name=image_name,
         dockerfile=config.dockerfile,
         use_sudo=use_sudo,
         tag=tag,
@@ -132,6 +152,13 @@ def init_config(
         else:
             return None
 
+    def json_prompt(text: str, default: dict, default_str: str) -> dict:
+        # Only parse the answer if the user did not accept the default
+        var = typer.prompt(text, default=default_str)
+        if var == default_str:
+            return dict(default)
+        return json.loads(var)
+
     initialized_config = UserCodeDeploymentsConfig(
         environment=typer.prompt("""What environment is this config for [dev, acc, prod etc.]"""),
         container_registry=typer.prompt("Container registry address"),
@@ -150,17 +177,15 @@ def init_config(
         cicd=typer.confirm(
             "Whether it's executed in CICD. If set to True, then the deployment_name is created from the env",
         ),
-        requests=json.loads(
-            typer.prompt(
-                "Request for the user pod in k8s in json formatted string",
-                default=json.dumps({"cpu": "1", "memory": "1Gi"}),
-            ),
+        requests=json_prompt(
+            "Request for the user pod in k8s in json formatted string",
+            default=_REQUESTS_DEFAULT,
+            default_str=_REQUESTS_DEFAULT_STR,
         ),
-        limits=json.loads(
-            typer.prompt(
-                "Limits for the user pod in k8s in json formatted string",
-                default=json.dumps({"cpu": "2", "memory": "2Gi"}),
-            ),
+        limits=json_prompt(
+            "Limits for the user pod in k8s in json formatted string",
+            default=_LIMITS_DEFAULT,
+            default_str=_LIMITS_DEFAULT_STR,
         ),
         kubernetes_context=typer.prompt("Kubernetes context of the cluster to use for api calls"),
         dagster_gui_url=optional_prompt("URL of dagster UI"),
@@ -178,11 +203,9 @@ def init_config(
         ),
     )
     with open(file, "w") as fp:
-        import yaml
-
-        config_dict = asdict(initialized_config)
+        config_dict = initialized_config.to_dict()
         complete_dict = {config_dict["environment"]: config_dict}
-        yaml.dump(complete_dict, fp, default_flow_style=False)
+        yaml.dump(complete_dict, fp, Dumper=YamlDumper, default_flow_style=False)
     typer.echo(f"Template configuration file generated as '{file}'.")
 
 
@@ -250,18 +273,24 @@ def deployment_delete(
     ] = "",
 ) -> None:
     if delete_all:
+        from kr8s.objects import ConfigMap
+
         handler.remove_all_deployments()
-        handler.delete_k8s_resources(
-            label_selector="app.kubernetes.io/name=dagster-user-deployments",
-        )
-        handler.delete_k8s_resources(label_selector="app=dagster-user-deployments")
-        for item in handler.api.get(
+        configmaps = handler.api.get(
             ConfigMap,
             namespace=config.namespace,
             label_selector="app=dagster-user-deployments",
-        ):
-            item.delete()  # type: ignore
-        handler.delete_k8s_resources(label_selector="dagster/code-location")
+        )
+        # Every deletion is an independent round-trip to the k8s api, so we issue them concurrently
+        run_concurrently(
+            partial(
+                handler.delete_k8s_resources,
+                "app.kubernetes.io/name=dagster-user-deployments",
+                "app=dagster-user-deployments",
+                "dagster/code-location",
+            ),
+            *[item.delete for item in configmaps],  # type: ignore
+        )
         handler.deploy_to_k8s()
         typer.echo("\033[1mDeleted all deployments\033[0m")
     else:
@@ -312,18 +341,76 @@ def check_deployment(
             f"Deployment with name '{name}' does not seem to exist in environment '{config.environment}'. Attempting to proceed with status check anyways.",
         )
     typer.echo(f"\033[1mStatus for deployment {name}\033[0m")
-    for pod in handler.api.get(
-        Pod,
-        label_selector=f"deployment={name}",
-        namespace=config.namespace,
-    ):
-        pod = cast(Pod, pod)
+    pods = handler.get_pods(f"deployment={name}")
+    # Log lines are written to stdout directly rather than through typer.echo, which adds per line
+    # overhead. Each line is flushed, so followed logs show up right away when stdout is a pipe.
+    stdout = sys.stdout
+    stdout_lock = threading.Lock()
+
+    def follow_logs(pod: "Pod") -> None:
+        # Lines of multiple pods are interleaved, so prefix them with the pod they came from
+        prefix = f"[{pod.name}] " if len(pods) > 1 else ""
         with contextlib.suppress(Exception):
             for line in pod.logs(pretty=True, follow=True, timeout=timeout):  # type: ignore
-                typer.echo(line)
+                with stdout_lock:
+                    stdout.write(f"{prefix}{line}\n")
+                    stdout.flush()
                 if "started dagster code server" in line.lower():
                     break
 
+    # Follow all pods at once, so a hanging pod doesn't hold up the logs of the others
+    run_concurrently(*[partial(follow_logs, pod) for pod in pods])
+
+
+def acquire_deployment_lock(reset_lock: bool) -> None:
+    """Blocks until the deployment semaphore is acquired"""
+    count = 0
+    while not handler.acquire_semaphore(reset_lock):
+        # Back off exponentially, so a lock that is released soon is picked up quickly
+        delay = min(0.5 * 2**count, 10.0)
+        logger.error(
+            f"Attempt {count}: Another deployment is in progress. Trying again in {delay:g} seconds. You can force a reset of the deployment lock by using 'dagster-uc deployment deploy --reset-lock'",
+        )
+        count += 1
+        time.sleep(delay)
+
+
+def wait_for_deployment(deployment_name: str, timeout: int, image_tag: str | None = None) -> None:
+    """Waits until the code pods of a deployment, running the given image tag, are ready"""
+    code_pods = handler.wait_for_code_pods(deployment_name, timeout=timeout, image_tag=image_tag)
+    if not code_pods:
+        logger.warning(
+            f"No code pods found for deployment '{deployment_name}' after waiting {timeout} seconds.",
+        )
+
+    def wait_until_ready(code_pod: "Pod") -> None:
+        with contextlib.suppress(Exception):
+            code_pod.wait("condition=Ready", timeout=timeout)
+
+    # Wait for all pods at once, so the total wait is that of the slowest pod
+    run_concurrently(*[partial(wait_until_ready, code_pod) for code_pod in code_pods])  # type: ignore
+
+
+def finish_deployments(deployments: list[tuple[str, str]], full_redeploy_done: bool) -> None:
+    """Prints the UI links of freshly deployed (name, tag) deployments, waits until their code pods
+    are ready and shows the status of each of them.
+    """
+    if config.dagster_gui_url:
+        for deployment_name, _ in deployments:
+            typer.echo(
+                f"Your assets: {config.dagster_gui_url.rstrip('/')}/locations/{deployment_name.replace('--', ':')}/assets\033[0m",
+            )
+    timeout = 40 if not full_redeploy_done else 240
+
+    run_concurrently(
+        *[
+            partial(wait_for_deployment, deployment_name, timeout=timeout, image_tag=tag)
+            for deployment_name, tag in deployments
+        ],
+    )
+    for deployment_name, _ in deployments:
+        check_deployment(deployment_name)
+
 
 @deployment_app.command(
     name="deploy",
@@ -371,27 +458,7 @@ def deployment_deploy(
         ),
     ] = False,
 ):
-    def is_command_available(command: str) -> bool:
-        try:
-            subprocess.run(
-                [command, "--version"],
-                capture_output=True,
-                check=True,  # ruff: ignore
-            )
-            return True
-        except subprocess.CalledProcessError:
-            return False
-        except FileNotFoundError:
-            return False
-
-    count = 0
-    while not handler.acquire_semaphore(reset_lock):
-        logger.error(
-            f"Attempt {count}: Another deployment is in progress. Trying again in 10 seconds. You can force a reset of the deployment lock by using 'dagster-uc deployment deploy --reset-lock'",
-        )
-        count += 1
-        time.sleep(10)
-
+    acquire_deployment_lock(reset_lock)
     try:
         logger.debug("Determining build tool...")
         if not is_command_available(BuildTool.podman.value):
@@ -410,11 +477,11 @@ def deployment_deploy(
                 dagster_deployment.branch_name,
             )
 
+        image_name = get_image_name(deployment_name, config.image_prefix)
+
         logger.debug("Determining tag...")
         new_tag = gen_tag(
-            deployment_name
-            if not config.image_prefix
-            else os.path.join(config.image_prefix, deployment_name),
+            image_name,
             config.container_registry,
             config.dagster_version,
             config.use_az_login,
@@ -425,38 +492,31 @@ def deployment_deploy(
         full_redeploy_done = False
         if not skip_build:
             build_push_container(
-                deployment_name,
+                image_name,
                 branch_name=branch_name,
-                image_prefix=handler.config.image_prefix,
                 config=config,
                 use_sudo=use_sudo,
                 tag=new_tag,
             )
 
+        # The existence check reads the deployments snapshot, which can be older than the build. So
+        # we always write with replace, which adds the deployment if it's missing and never duplicates it.
+        new_deployment = handler.gen_new_deployment_yaml(
+            deployment_name,
+            image_prefix=handler.config.image_prefix,
+            tag=new_tag,
+        )
         if not handler._check_deployment_exists(deployment_name):
             logger.info(
                 f"Deployment with name '{deployment_name}' does not exist yet in '{config.environment}'. Adding deployment to configmap",
             )
-            handler.add_user_deployment_to_configmap(
-                handler.gen_new_deployment_yaml(
-                    deployment_name,
-                    image_prefix=handler.config.image_prefix,
-                    tag=new_tag,
-                ),
-            )
+            handler.replace_user_deployment_in_configmap(new_deployment)
             handler.deploy_to_k8s()
         else:
             logger.info(
                 f"Deployment with name '{deployment_name}' exists in '{config.environment}'. Updating deployment in configmap",
             )
-            handler.remove_user_deployment_from_configmap(deployment_name)
-            handler.add_user_deployment_to_configmap(
-                handler.gen_new_deployment_yaml(
-                    deployment_name,
-                    image_prefix=handler.config.image_prefix,
-                    tag=new_tag,
-                ),
-            )
+            handler.replace_user_deployment_in_configmap(new_deployment)
             if config.cicd or force:
                 handler.delete_k8s_resources_for_user_deployment(deployment_name)
                 handler.deploy_to_k8s()
@@ -474,31 +534,141 @@ def deployment_deploy(
                 handler.deploy_to_k8s(reload_dagster=False)
     finally:
         handler.release_semaphore()
-    if config.dagster_gui_url:
-        typer.echo(
-            f"Your assets: {config.dagster_gui_url.rstrip('/')}/locations/{deployment_name.replace('--', ':')}/assets\033[0m",
-        )
-    time.sleep(5)
-    timeout = 40 if not full_redeploy_done else 240
+    finish_deployments([(deployment_name, new_tag)], full_redeploy_done=full_redeploy_done)
 
-    while True:
-        code_pods = list(
-            handler.api.get(
-                Pod,
-                label_selector=f"deployment={deployment_name}",
-                namespace=config.namespace,
-            ),
+
+@deployment_app.command(
+    name="deploy-many",
+    help="Deploys the currently checked out git branch as multiple user code deployments, building and pushing their images in parallel",
+    no_args_is_help=True,
+)
+def deployment_deploy_many(
+    deployment_names: Annotated[
+        list[str],
+        typer.Option(
+            "--deployment-name",
+            "-n",
+            help="The name of a deployment to deploy. Can be provided multiple times.",
+        ),
+    ],
+    force: Annotated[
+        bool,
+        typer.Option(
+            "--force",
+            "-f",
+            help="If this is provided, a full redeploy will always be done, rather than just rebooting user code pods if they already exist in order to trigger a new image pull",
+        ),
+    ] = False,
+    skip_build: bool = typer.Option(
+        False,
+        "--skip-build",
+        "-b",
+        help="Image builds and pushes will be skipped",
+    ),
+    reset_lock: bool = typer.Option(
+        False,
+        "--reset-lock",
+        "-r",
+        help="Reset the deployment semaphore of any ongoing other deployments.",
+    ),
+    use_sudo: Annotated[
+        bool,
+        typer.Option(
+            "--use-sudo",
+            "-u",
+            help="If this is provided, buildah or docker will be called with sudo",
+        ),
+    ] = False,
+    parallel: Annotated[
+        int,
+        typer.Option(
+            "--parallel",
+            "-p",
+            min=1,
+            help="The maximum number of images that are built and pushed at the same time.",
+        ),
+    ] = 4,
+    jobs: Annotated[
+        int | None,
+        typer.Option(
+            "--jobs",
+            "-j",
+            help="The number of stages of a multi-stage Containerfile podman builds in parallel per image.",
+        ),
+    ] = None,
+):
+    # In case the UI name separator of the deployment is passed
+    deployment_names = list(dict.fromkeys(name.replace(":", "--") for name in deployment_names))
+
+    acquire_deployment_lock(reset_lock)
+    try:
+        full_redeploy_done = False
+        if not is_command_available(BuildTool.podman.value):
+            raise Exception("Podman installation is required to run dagster-uc.")
+
+        # Log in once up front, concurrent logins would race on podman's auth file
+        if config.use_az_login:
+            login_registry(config.container_registry)
+
+        logger.debug("Determining tags...")
+        image_names = [get_image_name(name, config.image_prefix) for name in deployment_names]
+        tags = run_concurrently(
+            *[
+                partial(
+                    gen_tag,
+                    image_name,
+                    config.container_registry,
+                    config.dagster_version,
+                    use_az_login=False,
+                )
+                for image_name in image_names
+            ],
         )
-        if len(code_pods) == 0:
-            time.sleep(2)
-            continue
-        else:
-            break
+        for name, tag in zip(deployment_names, tags):
+            typer.echo(f"Deploying deployment \033[1m'{name}:{tag}'\033[0m")
 
-    with contextlib.suppress(Exception):
-        for code_pod in code_pods:
-            code_pod.wait("condition=Ready", timeout=timeout)  # type: ignore
-    check_deployment(deployment_name)
+        if not skip_build:
+            handler.update_dagster_workspace_yaml()
+            run_concurrently(
+                *[
+                    partial(
+                        build_and_push,
+                        config.repository_root,
+                        config.container_registry,
+                        image_name=image_name,
+                        dockerfile=config.dockerfile,
+                        use_sudo=use_sudo,
+                        tag=tag,
+                        branch_name=name,
+                        use_az_login=False,
+                        jobs=jobs,
+                    )
+                    for name, image_name, tag in zip(deployment_names, image_names, tags)
+                ],
+                max_workers=parallel,
+            )
+
+        for name, tag in zip(deployment_names, tags):
+            new_deployment = handler.gen_new_deployment_yaml(
+                name,
+                image_prefix=handler.config.image_prefix,
+                tag=tag,
+            )
+            # The snapshot behind the existence check can be older than the builds, so only use it
+            # to pick the branch and always write with replace, which never duplicates a deployment
+            exists = handler._check_deployment_exists(name)
+            handler.replace_user_deployment_in_configmap(new_deployment)
+            if exists:
+                handler.delete_k8s_resources_for_user_deployment(
+                    name,
+                    delete_deployments=config.cicd
+                    or force
+                    or not handler.check_if_code_pod_exists(label=name),
+                )
+        handler.deploy_to_k8s()
+    finally:
+        handler.release_semaphore()
+    finish_deployments(list(zip(deployment_names, tags)), full_redeploy_done=full_redeploy_done)
 
 
 if __name__ == "__main__":
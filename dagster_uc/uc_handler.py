@@ -1,13 +1,19 @@
 import asyncio
+import contextlib
 import logging
+import random
 import re
 import subprocess
+import threading
+import time
 from collections.abc import Callable
+from functools import partial
 from typing import NamedTuple
 
 import kr8s
 import yaml
 from kr8s.objects import (
+    APIObject,
     ConfigMap,
     Deployment,
     Pod,
@@ -18,9 +24,10 @@ from kr8s.objects import Service as Service
 from kr8s.objects import ServiceAccount as ServiceAccount
 from packaging.version import Version
 
-from dagster_uc.config import UserCodeDeploymentsConfig
+from dagster_uc.config import UserCodeDeploymentsConfig, YamlDumper, YamlLoader
 from dagster_uc.configmaps import BASE_CONFIGMAP, BASE_CONFIGMAP_DATA
 from dagster_uc.log import logger
+from dagster_uc.utils import run_concurrently
 
 
 class DagsterDeployment(NamedTuple):
@@ -36,6 +43,11 @@ class DagsterUserCodeHandler:
     def __init__(self, config: UserCodeDeploymentsConfig, kr8s_api: kr8s.Api) -> None:
         self.config = config
         self.api = kr8s_api
+        # Snapshot of the deployments array, kept up to date by the methods that modify it
+        self._deployments: list[dict] | None = None
+        self._deployment_names: set[str] | None = None
+        # Recently listed pods keyed on (label_selector, namespace), storing (time listed, pods)
+        self._pod_cache: dict[tuple[str, str], tuple[float, list[Pod]]] = {}
 
     def maybe_create_user_deployments_configmap(self) -> None:
         """Creates a user deployments_configmap if it doesn't exist yet."""
@@ -47,6 +59,7 @@ class DagsterUserCodeHandler:
         )
         dagster_user_deployments_values_yaml_configmap["data"]["yaml"] = yaml.dump(
             BASE_CONFIGMAP_DATA,
+            Dumper=YamlDumper,
         )
         try:
             self._read_namespaced_config_map(
@@ -69,24 +82,33 @@ class DagsterUserCodeHandler:
         dagster_user_deployments_values_yaml_configmap = deepcopy(BASE_CONFIGMAP)
         dagster_user_deployments_values_yaml_configmap["data"]["yaml"] = yaml.dump(
             BASE_CONFIGMAP_DATA,
+            Dumper=YamlDumper,
         )
 
         configmap = self._read_namespaced_config_map(
             self.config.user_code_deployments_configmap_name,
         )
         configmap.patch(dagster_user_deployments_values_yaml_configmap)
+        self._set_deployments([])
 
     def list_deployments(
         self,
     ) -> list[dict]:
         """Get the contents of the deployments array from the values.yaml of dagster's user-code deployment chart as it is
-        currently stored on k8s.
+        currently stored on k8s. The configmap is only read once per handler, later calls return the snapshot.
         """
-        config_map = self._read_namespaced_config_map(
-            self.config.user_code_deployments_configmap_name,
-        )
-        current_deployments: list = yaml.safe_load(config_map["data"]["yaml"])["deployments"]
-        return current_deployments
+        if self._deployments is None:
+            config_map = self._read_namespaced_config_map(
+                self.config.user_code_deployments_configmap_name,
+            )
+            values_yaml = yaml.load(config_map["data"]["yaml"], Loader=YamlLoader)
+            self._set_deployments(values_yaml["deployments"])
+        return list(self._deployments)  # type: ignore
+
+    def _set_deployments(self, deployments: list[dict]) -> None:
+        """Updates the snapshot of the deployments array"""
+        self._deployments = deployments
+        self._deployment_names = {d["name"] for d in deployments}
 
     def get_deployment(
         self,
@@ -107,7 +129,9 @@ class DagsterUserCodeHandler:
         """Return True if the deployment exists. This is done by reading the configmap of values.yaml for dagster's
         user-code deployment chart and checking if the deployments array contains this particular deployment_name
         """
-        return self.get_deployment(name) is not None
+        if self._deployment_names is None:
+            self.list_deployments()
+        return name in self._deployment_names  # type: ignore
 
     def update_dagster_workspace_yaml(
         self,
@@ -137,7 +161,7 @@ class DagsterUserCodeHandler:
                     ),  ## We replace the -- separator with `:` for more friendly UI name
                 }
                 data["load_from"].append({"grpc_server": grpc_server})
-            return yaml.dump(data)
+            return yaml.dump(data, Dumper=YamlDumper)
 
         workspaceyaml = generate_grpc_servers_yaml(
             self.list_deployments(),
@@ -170,12 +194,14 @@ class DagsterUserCodeHandler:
         from pyhelm3 import Client
         from pytz import timezone
 
+        self._pod_cache.clear()
         tz = timezone("Europe/Amsterdam")
 
-        values_dict = yaml.safe_load(
+        values_dict = yaml.load(
             self._read_namespaced_config_map(self.config.user_code_deployments_configmap_name)[
                 "data"
             ]["yaml"],
+            Loader=YamlLoader,
         )
         self.update_dagster_workspace_yaml()
 
@@ -233,6 +259,7 @@ class DagsterUserCodeHandler:
         """Deletes all k8s resources related to a specific user code deployment.
         Returns a boolean letting you know if pod was found
         """
+        self._pod_cache.clear()
         for pod in self.api.get(
             Pod,
             label_selector=f"dagster/code-location={label}",
@@ -243,8 +270,6 @@ class DagsterUserCodeHandler:
             pod.delete()
 
         if delete_deployments:
-            import contextlib
-
             with contextlib.suppress(kr8s.NotFoundError):
                 Deployment.get(
                     namespace=self.config.namespace,
@@ -361,6 +386,22 @@ class DagsterUserCodeHandler:
 
         self._modify_user_deployments(modify_func)
 
+    def replace_user_deployment_in_configmap(
+        self,
+        new_deployment: dict,
+    ) -> None:
+        """This function replaces the user-code deployment with the same name as the new user-code deployment
+        yaml in the deployments array of the values.yaml of dagster's user-code deployment chart, adding it if
+        it doesn't exist yet. This is a single read and write of the configmap.
+        (referring to the values.yaml that is stored in a configmap on k8s.)
+        """
+
+        def modify_func(current_deployments: list[dict]) -> list[dict]:
+            filtered = [d for d in current_deployments if d["name"] != new_deployment["name"]]
+            return filtered + [new_deployment]
+
+        self._modify_user_deployments(modify_func)
+
     def _modify_user_deployments(
         self,
         modify_func: Callable[[list[dict]], list[dict]],
@@ -369,7 +410,8 @@ class DagsterUserCodeHandler:
 
         This function allows for customization of the deployments array by providing a `modify_func` which
         will process the current list of deployments and should return the modified list of deployments.
-        This operation is treated as a transaction.
+        This operation is treated as a transaction: the patch carries the resourceVersion that was read, so
+        k8s rejects it with a conflict if the configmap was modified in the meantime.
 
         Args:
             modify_func (Callable[[List[dict]], List[dict]]): A function that takes the current list of
@@ -390,7 +432,8 @@ class DagsterUserCodeHandler:
             .get("annotations", {})
             .get("kubectl.kubernetes.io/last-applied-configuration", None)
         )
-        current_deployments: list = yaml.safe_load(configmap["data"]["yaml"])["deployments"]
+        values_yaml = yaml.load(configmap["data"]["yaml"], Loader=YamlLoader)
+        current_deployments: list = values_yaml["deployments"]
 
         current_deployments = modify_func(current_deployments)
 
@@ -404,16 +447,18 @@ class DagsterUserCodeHandler:
         new_configmap_data["deployments"] = current_deployments
 
         new_configmap = deepcopy(BASE_CONFIGMAP)
-        new_configmap["data"]["yaml"] = yaml.dump(new_configmap_data)
+        new_configmap["data"]["yaml"] = yaml.dump(new_configmap_data, Dumper=YamlDumper)
 
         new_configmap["metadata"] = {
             "name": self.config.user_code_deployments_configmap_name,
             "namespace": self.config.namespace,
+            "resourceVersion": configmap["metadata"]["resourceVersion"],
             "annotations": {
                 "kubectl.kubernetes.io/last-applied-configuration": last_applied_configuration,
             },
         }
         configmap.patch(new_configmap)
+        self._set_deployments(current_deployments)
 
     def get_deployment_name(  # noqa: D102
         self,
@@ -469,20 +514,107 @@ class DagsterUserCodeHandler:
                 f"Dagster version mismatch. Local: {local_dagster_version}, Cluster: {cluster_dagster_version}. Try pulling the latest changes from the develop branch and then rebuilding the local python environment.",
             )
 
-    def check_if_code_pod_exists(self, label: str) -> bool:
-        """Checks if the code location pod of specific label is available"""
-        running_pods = list(
+    def get_pods(self, label_selector: str, max_age: float = 2.0) -> list[Pod]:
+        """Lists the pods with a specified label_selector. Pods listed less than max_age seconds ago are
+        served from a cache, which is cleared whenever this handler deploys or deletes resources.
+        """
+        key = (label_selector, self.config.namespace)
+        cached = self._pod_cache.get(key)
+        if cached is not None and time.monotonic() - cached[0] < max_age:
+            return list(cached[1])
+
+        pods = list(
             self.api.get(
                 Pod,
-                label_selector=f"deployment={label}",
+                label_selector=label_selector,
                 namespace=self.config.namespace,
             ),
         )
+        self._pod_cache[key] = (time.monotonic(), pods)  # type: ignore
+        return list(pods)  # type: ignore
+
+    def check_if_code_pod_exists(self, label: str) -> bool:
+        """Checks if the code location pod of specific label is available"""
+        running_pods = self.get_pods(f"deployment={label}")
         return len(running_pods) > 0
 
-    def delete_k8s_resources(self, label_selector: str):
-        """Delete all k8s resources with a specified label_selector"""
-        for resource in [
+    def wait_for_code_pods(
+        self,
+        label: str,
+        timeout: float,
+        image_tag: str | None = None,
+    ) -> list[Pod]:
+        """Waits until at least one code location pod of specific label exists and returns all of them.
+        If an image_tag is given, only pods running that tag of the image are considered, so pods of a
+        previous rollout are neither waited for nor returned. Returns an empty list if no pod appeared
+        within the timeout.
+        """
+
+        def runs_image_tag(pod: Pod) -> bool:
+            if image_tag is None:
+                return True
+            return any(
+                container.get("image", "").endswith(f":{image_tag}")
+                for container in pod.raw["spec"]["containers"]
+            )
+
+        def list_code_pods() -> list[Pod]:
+            # Always list the pods anew, as we are waiting for them to change
+            code_pods = self.get_pods(f"deployment={label}", max_age=0)
+            return [pod for pod in code_pods if runs_image_tag(pod)]
+
+        def code_pod_exists() -> bool:
+            # Consumes the listing lazily and stops at the first matching pod
+            code_pods = self.api.get(
+                Pod,
+                label_selector=f"deployment={label}",
+                namespace=self.config.namespace,
+            )
+            return any(runs_image_tag(pod) for pod in code_pods)  # type: ignore
+
+        watch_errors: list[Exception] = []
+
+        def watch_pods() -> None:
+            # The watch first emits ADDED events for already existing pods, then for new ones
+            try:
+                for event_type, pod in self.api.watch(
+                    Pod,  # type: ignore
+                    namespace=self.config.namespace,
+                    label_selector=f"deployment={label}",
+                ):
+                    if event_type in ("ADDED", "MODIFIED") and runs_image_tag(pod):  # type: ignore
+                        break
+            except Exception as e:
+                watch_errors.append(e)
+
+        # The watch and the polling fallback share one deadline, so the total wait is bounded by timeout
+        deadline = time.monotonic() + timeout
+
+        # The watch has no timeout of its own, so it runs in a daemon thread that we stop waiting for
+        watcher = threading.Thread(target=watch_pods, daemon=True)
+        watcher.start()
+        watcher.join(max(0.0, deadline - time.monotonic()))
+
+        if watch_errors:
+            logger.debug(f"Watching pods failed, falling back to polling: {watch_errors[0]}")
+            backoff = 0.1
+            while not code_pod_exists() and time.monotonic() < deadline:
+                # Poll quickly at first and back off to at most every 2 seconds, with jitter so
+                # concurrent waits don't poll the api server in lockstep
+                delay = backoff + random.uniform(0, backoff * 0.1)
+                time.sleep(max(0.0, min(delay, deadline - time.monotonic())))
+                backoff = min(backoff * 1.5, 2.0)
+
+        return list_code_pods()
+
+    def delete_k8s_resources(self, *label_selectors: str):
+        """Delete all k8s resources matching any of the specified label_selectors.
+
+        Label selectors are AND-ed by k8s, so each selector needs its own list request. All list and
+        delete requests are issued concurrently, and resources matching multiple selectors are only
+        deleted once.
+        """
+        resources = [
             "Pod",
             "ReplicationController",
             "Service",
@@ -493,14 +625,35 @@ class DagsterUserCodeHandler:
             "HorizontalPodAutoscaler",
             "CronJob",
             "Job",
-        ]:
-            for item in self.api.get(
-                resource,
-                namespace=self.config.namespace,
-                label_selector=label_selector,
-            ):
+        ]
+
+        def list_items(resource: str, label_selector: str) -> list[APIObject]:
+            return list(
+                self.api.get(
+                    resource,
+                    namespace=self.config.namespace,
+                    label_selector=label_selector,
+                ),
+            )  # type: ignore
+
+        item_lists = run_concurrently(
+            *[
+                partial(list_items, resource, label_selector)
+                for resource in resources
+                for label_selector in label_selectors
+            ],
+        )
+        self._pod_cache.clear()
+        items = {item.metadata.uid: item for item_list in item_lists for item in item_list}
+
+        def delete_item(item: APIObject) -> None:
+            # Deleting an owner like a Deployment or Job makes k8s garbage collect the objects it owns,
+            # which may be listed here as well and can be gone by the time we delete them ourselves
+            with contextlib.suppress(kr8s.NotFoundError):
                 item.delete()
 
+        run_concurrently(*[partial(delete_item, item) for item in items.values()])
+
     def acquire_semaphore(self, reset_lock: bool = False) -> bool:
         """Acquires a semaphore by creating a configmap"""
         if reset_lock:
@@ -1,14 +1,21 @@
 import os
 import re
+import shutil
 import subprocess
 import sys
+import threading
+from collections.abc import Callable
 from enum import Enum
+from functools import cache
 from subprocess import Popen, TimeoutExpired
+from typing import TypeVar
 
 import typer
 
 from dagster_uc.log import logger
 
+T = TypeVar("T")
+
 
 class BuildTool(str, Enum):
     """The possible build tools to choose from"""
@@ -28,6 +35,46 @@ def exception_on_failed_subprocess(res: subprocess.CompletedProcess) -> None:
         raise Exception("Subprocess failed")
 
 
+def run_concurrently(*funcs: Callable[[], T], max_workers: int = 16) -> list[T]:
+    """Runs the functions in threads and returns their results in the order they were passed.
+    Waits for all functions to finish and then raises the first exception, if any occurred.
+
+    A single function runs inline. Otherwise the functions run in daemon threads, so a Ctrl-C
+    interrupts the wait right away instead of blocking until every function has returned.
+    """
+    if len(funcs) <= 1:
+        return [func() for func in funcs]
+    if max_workers < 1:
+        raise ValueError("max_workers must be greater than 0")
+
+    results: list = [None] * len(funcs)
+    errors: list[BaseException | None] = [None] * len(funcs)
+    worker_slots = threading.Semaphore(max_workers)
+
+    def run(index: int, func: Callable[[], T]) -> None:
+        with worker_slots:
+            try:
+                results[index] = func()
+            except BaseException as e:
+                errors[index] = e
+
+    threads = [
+        threading.Thread(target=run, args=(index, func), daemon=True)
+        for index, func in enumerate(funcs)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        # Join with a timeout, as a join without one can't be interrupted by Ctrl-C on every platform
+        while thread.is_alive():
+            thread.join(0.1)
+
+    for error in errors:
+        if error is not None:
+            raise error
+    return results
+
+
 def run_cli_command(
     cmd: str,
     ignore_failures: bool = False,
@@ -111,8 +158,11 @@ def run_cli_command_streaming(cmd: str, as_user: str = "") -> None:
     Popen(cmd, stdout=sys.stdout, stderr=sys.stderr, env=os.environ.copy(), shell=True)
 
 
-def login_registry(image_registry: str) -> None:
-    """Logs into registry with az cli"""
+@cache
+def login_registry(image_registry: str, /) -> None:
+    """Logs into registry with az cli. Only logs in once per registry for the lifetime of the process.
+    The registry is positional-only, so every call shares the same cache key.
+    """
     typer.echo("Logging into acr...")
     cmd = [
         "az",
@@ -142,6 +192,12 @@ def login_registry(image_registry: str) -> None:
     exception_on_failed_subprocess(subprocess.run(cmd, input=token, capture_output=False))
 
 
+@cache
+def is_command_available(command: str) -> bool:
+    """Returns True if the command is an executable on the PATH, the result is cached for the process"""
+    return shutil.which(command) is not None
+
+
 def build_and_push(
     repository_root: str,
     image_registry: str,
@@ -151,34 +207,40 @@ def build_and_push(
     tag: str,
     branch_name: str,
     use_az_login: bool,
+    jobs: int | None = None,
 ):
-    """Build a docker image and push it to the registry"""
+    """Build a docker image and push it to the registry.
+
+    The commands run with the repository root as working dir instead of changing the working dir of
+    this process, so multiple images can be built in parallel from threads.
+    """
     # We need to work from the root of the repo so docker can access all files
-    previous_dir = os.getcwd()
-    os.chdir(repository_root)
+    repository_root = os.path.abspath(repository_root)
 
     cmd = [
         BuildTool.podman.value,
         "build",
         "-f",
-        os.path.join(os.getcwd(), dockerfile),
+        os.path.join(repository_root, dockerfile),
         "-t",
         os.path.join(image_registry, f"{image_name}:{tag}"),
         "--build-arg=BRANCH_NAME=" + branch_name,
         ".",
     ]
+    if jobs is not None:
+        # Number of stages of a multi-stage Containerfile to build in parallel
+        cmd.insert(2, f"--jobs={jobs}")
 
     if use_sudo:
         cmd = ["sudo"] + cmd
 
-    exception_on_failed_subprocess(subprocess.run(cmd, capture_output=False))
+    exception_on_failed_subprocess(subprocess.run(cmd, capture_output=False, cwd=repository_root))
 
     if use_az_login:
-        login_registry(image_registry=image_registry)
+        login_registry(image_registry)
 
     typer.echo("Pushing image...")
     cmd = [BuildTool.podman.value, "push", os.path.join(image_registry, f"{image_name}:{tag}")]
     if use_sudo:
         cmd = ["sudo"] + cmd
-    exception_on_failed_subprocess(subprocess.run(cmd, capture_output=False))
-    os.chdir(previous_dir)
+    exception_on_failed_subprocess(subprocess.run(cmd, capture_output=False, cwd=repository_root))
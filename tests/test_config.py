@@ -0,0 +1,82 @@
+import os
+
+import pytest
+import yaml
+
+from dagster_uc import config as config_module
+from dagster_uc.config import load_config
+
+CONFIG = {
+    "dev": {
+        "environment": "dev",
+        "container_registry": "myacr.azurecr.io",
+        "dockerfile": "./Dockerfile",
+        "image_prefix": "team-alpha",
+        "namespace": "dagster-dev",
+        "node": "small",
+        "code_path": "dagster_pipelines/repo.py",
+        "docker_root": ".",
+        "repository_root": ".",
+        "dagster_version": "1.8.4",
+        "user_code_deployment_env_secrets": [],
+        "user_code_deployment_env": [],
+        "cicd": False,
+        "limits": {"cpu": "2", "memory": "2Gi"},
+        "requests": {"cpu": "1", "memory": "1Gi"},
+        "kubernetes_context": "my-kubernetes-context",
+    },
+}
+
+
+@pytest.fixture(autouse=True)
+def cache_dir(tmp_path, monkeypatch):  # noqa: ANN001, ANN201
+    """Isolate the on-disk and in-memory config caches per test"""
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path / "cache"))
+    monkeypatch.setattr(config_module, "_CONFIG_CACHE", config_module.OrderedDict())
+    return tmp_path / "cache" / "dagster-uc"
+
+
+def test_load_config_reloads_changed_file(tmp_path) -> None:  # noqa: ANN001
+    """Check that a cached config is not served after the file has changed"""
+    path = tmp_path / "config.yaml"
+    path.write_text(yaml.dump(CONFIG))
+    config = load_config("dev", str(path))
+    assert config.node == "small"
+
+    config.limits["cpu"] = "4"
+    assert load_config("dev", str(path)).limits["cpu"] == "2"
+
+    changed = {"dev": {**CONFIG["dev"], "node": "large"}}
+    path.write_text(yaml.dump(changed))
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1))
+    assert load_config("dev", str(path)).node == "large"
+
+
+def test_load_config_uses_json_sidecar(tmp_path, cache_dir) -> None:  # noqa: ANN001
+    """Check that a fresh process is served from the json sidecar of an unchanged config file"""
+    path = tmp_path / "config.yaml"
+    path.write_text(yaml.dump(CONFIG))
+    load_config("dev", str(path))
+    assert len(list(cache_dir.glob("config.yaml.*.json"))) == 1
+    if os.name == "posix":
+        assert next(cache_dir.glob("config.yaml.*.json")).stat().st_mode & 0o077 == 0
+
+    config_module._CONFIG_CACHE.clear()
+    sidecar = next(cache_dir.glob("config.yaml.*.json"))
+    sidecar.write_text(sidecar.read_text().replace("small", "from-sidecar"))
+    assert load_config("dev", str(path)).node == "from-sidecar"
+
+
+def test_load_config_ignores_sidecar_of_same_mtime(tmp_path) -> None:  # noqa: ANN001
+    """Check that a config file rewritten with its old mtime is not served from the old sidecar"""
+    path = tmp_path / "config.yaml"
+    path.write_text(yaml.dump(CONFIG))
+    stat = os.stat(path)
+    load_config("dev", str(path))
+
+    config_module._CONFIG_CACHE.clear()
+    changed = {"dev": {**CONFIG["dev"], "namespace": "dagster-prd"}}
+    path.write_text(yaml.dump(changed))
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+    assert load_config("dev", str(path)).namespace == "dagster-prd"
@@ -0,0 +1,31 @@
+import _thread
+import threading
+import time
+
+import pytest
+
+from dagster_uc import manage_user_code_deployments as cli
+
+
+class SlowPod:
+    """Stand-in for a code pod that takes long to become ready"""
+
+    def wait(self, *_args, **_kwargs) -> None:  # noqa: D102
+        time.sleep(5)
+
+
+class FakeHandler:
+    """Stand-in for the handler that returns slow code pods"""
+
+    def wait_for_code_pods(self, *_args, **_kwargs) -> list[SlowPod]:  # noqa: D102
+        return [SlowPod(), SlowPod()]
+
+
+def test_wait_for_deployment_interruptible(monkeypatch) -> None:  # noqa: ANN001
+    """Check that Ctrl-C stops the readiness wait without waiting for the pods"""
+    monkeypatch.setattr(cli, "handler", FakeHandler(), raising=False)
+    threading.Timer(0.2, _thread.interrupt_main).start()
+    start = time.monotonic()
+    with pytest.raises(KeyboardInterrupt):
+        cli.wait_for_deployment("my-deployment", timeout=40)
+    assert time.monotonic() - start < 2
@@ -0,0 +1,46 @@
+import subprocess
+
+from dagster_uc import utils
+from dagster_uc.utils import build_and_push, gen_tag, login_registry
+
+
+class FakePopen:
+    """Stand-in for the az cli process that hands out the registry token"""
+
+    calls = 0
+
+    def __init__(self, *_args, **_kwargs) -> None:
+        FakePopen.calls += 1
+
+    def communicate(self) -> tuple[bytes, None]:  # noqa: D102
+        return b"token", None
+
+
+def test_login_registry_once_per_registry(monkeypatch, tmp_path) -> None:  # noqa: ANN001
+    """Check that gen_tag and build_and_push share a single registry login"""
+    run_cmds = []
+
+    def fake_run(cmd, *_args, **_kwargs) -> subprocess.CompletedProcess:  # noqa: ANN001
+        run_cmds.append(cmd)
+        return subprocess.CompletedProcess(cmd, 0, stdout=b"", stderr=b"")
+
+    monkeypatch.setattr(utils.subprocess, "Popen", FakePopen)
+    monkeypatch.setattr(utils.subprocess, "run", fake_run)
+    login_registry.cache_clear()
+    FakePopen.calls = 0
+
+    gen_tag("my-image", "myacr.azurecr.io", "1.8.4", use_az_login=True)
+    build_and_push(
+        str(tmp_path),
+        "myacr.azurecr.io",
+        image_name="my-image",
+        dockerfile="Dockerfile",
+        use_sudo=False,
+        tag="1.8.4-0",
+        branch_name="main",
+        use_az_login=True,
+    )
+    login_registry.cache_clear()
+
+    assert FakePopen.calls == 1
+    assert sum(1 for cmd in run_cmds if "login" in cmd) == 1